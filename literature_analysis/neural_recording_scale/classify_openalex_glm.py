@@ -11,24 +11,44 @@ Usage:
       --input data/openalex_biorxiv_neuro_2025-11-24.jsonl \
       --output data/openalex_grok_labels_2025-11-24.jsonl \
       --max 100 --batch-size 10
+
+Paths ending in .zst are read/written as zstd-compressed JSONL (--compress
+appends the suffix to --output). Verdicts are cached by abstract hash next to
+the output, so repeated abstracts are answered without an API call.
 """
 
 from __future__ import annotations
 
 import argparse
-import json
+import hashlib
+import io
 import math
 import os
+import queue
+import re
+import shelve
+import sqlite3
 import threading
 import time
 from collections import deque
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from email.utils import parsedate_to_datetime
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Callable, Dict, Iterator, List, Mapping, Optional, Tuple
 
+import orjson
 import requests
+import zstandard as zstd
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
+from urllib3.util.retry import Retry
+
 
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+
+# Rough cap on title+abstract characters per batch (~4 chars/token) so an
+# auto-grown batch stays well inside the model context window.
+MAX_BATCH_CHARS = 60_000
 
 # Default model: GLM 4.5 Air free endpoint via OpenRouter
 DEFAULT_MODEL = "z-ai/glm-4.5-air:free"
@@ -37,7 +57,8 @@ SYSTEM_PROMPT = (
     "Respond ONLY with JSON exactly as requested. No commentary."
 )
 
-USER_TEMPLATE = """You will receive a batch of paper metadata (id, title, first author, year, abstract).
+# Static rubric, sent first so providers can cache it as a prompt prefix.
+USER_RUBRIC = """You will receive a batch of paper metadata (id, title, first author, year, abstract).
 For each paper, decide if the full paper likely contains useful information about state-of-the-art neural recording methods.
 Focus ONLY on invasive methods: penetrating electrodes, ECoG arrays, calcium or voltage imaging (including miniscope/mesoscope/two-photon/three-photon/light-sheet), functional ultrasound (typically requires craniotomy). Ignore non-invasive EEG/MEG/fMRI unless clearly paired with invasive recordings.
 
@@ -64,35 +85,207 @@ Always include all fields above. Use "N/A" when a field is not inferable from th
 
 Return a JSON array (no prose) where each element corresponds to one input paper, in the same order.
 
-INPUT PAPERS:
+"""
+
+# Per-batch part of the user message, pre-split around the {items} slot.
+ITEMS_TEMPLATE = """INPUT PAPERS:
 {items}
 """
+PROMPT_HEAD, PROMPT_TAIL = ITEMS_TEMPLATE.split("{items}")
+
+# OpenRouter providers that only cache with explicit `cache_control` breakpoints;
+# the others (OpenAI, DeepSeek, Grok, GLM, ...) cache a repeated prefix implicitly.
+CACHE_CONTROL_PREFIXES = ("anthropic/", "google/gemini")
+
+# Seconds to pause all workers after a 429 that carries no Retry-After hint.
+DEFAULT_RETRY_AFTER = 10.0
 
 
 def reconstruct_abstract(inv: Dict[str, List[int]]) -> str:
     """Rebuild abstract from OpenAlex inverted index."""
     if not inv:
         return ""
-    max_pos = max(pos for positions in inv.values() for pos in positions)
-    words = [""] * (max_pos + 1)
+    # Positions are normally dense (0..n-1), so size the list from the position
+    # count in one cheap pass and only grow it when an index has gaps.
+    words = [""] * sum(map(len, inv.values()))
     for word, positions in inv.items():
         for pos in positions:
-            words[pos] = word
+            try:
+                words[pos] = word
+            except IndexError:
+                words.extend([""] * (pos + 1 - len(words)))
+                words[pos] = word
+    # Duplicate positions over-allocate; trim so the tail matches the max position.
+    while words and not words[-1]:
+        words.pop()
     return " ".join(words)
 
 
-def call_openrouter(api_key: str, prompt: str, model: str) -> str:
-    url = "https://openrouter.ai/api/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "HTTP-Referer": "https://github.com/NZ99/neural_recordings",
-        "Content-Type": "application/json",
-    }
+def make_session(api_key: str, concurrency: int, max_retries: int) -> requests.Session:
+    """Shared keep-alive session so batches reuse pooled TLS connections.
+
+    Each worker thread holds at most one in-flight request, so the pool is sized
+    to the worker count and blocks instead of opening throwaway overflow sockets.
+    Transient 5xx failures are retried by urllib3 with backoff. 429s are not:
+    they go back to the caller so the retry passes through its rate limiter
+    and call budget.
+    """
+    session = requests.Session()
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=1.5,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset({"POST"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=concurrency,
+        pool_block=True,
+        max_retries=retry,
+    )
+    session.mount("https://", adapter)
+    session.headers.update(
+        {
+            "Authorization": f"Bearer {api_key}",
+            "HTTP-Referer": "https://github.com/NZ99/neural_recordings",
+            "Content-Type": "application/json",
+        }
+    )
+    return session
+
+
+def open_jsonl(path: Path, mode: str = "rb"):
+    """Open a JSONL file in binary mode, transparently (de)compressing *.zst."""
+    raw = path.open(mode)
+    if path.suffix != ".zst":
+        return raw
+    if "r" in mode:
+        return io.BufferedReader(zstd.ZstdDecompressor().stream_reader(raw, read_across_frames=True))
+    return zstd.ZstdCompressor(level=6, threads=-1).stream_writer(raw)
+
+
+def iter_records(
+    path: Path,
+    start: int = 0,
+    limit: Optional[int] = None,
+    offset: int = 0,
+    index: int = 0,
+) -> Iterator[Tuple[int, int, dict]]:
+    """Stream (record_index, end_byte_offset, record) triples from a JSONL file.
+
+    Reading begins at byte `offset`, which must hold record number `index`.
+    Records before `start` are skipped and reading stops after `start + limit`.
+    """
+    stop = start + limit if limit else None
+    with open_jsonl(path) as fp:
+        if fp.seekable():
+            fp.seek(offset)
+        else:
+            # zstd streams only move forward: offsets count decompressed bytes
+            skip = offset
+            while skip > 0:
+                chunk = fp.read(min(skip, 1 << 20))
+                if not chunk:
+                    break
+                skip -= len(chunk)
+        for line in fp:
+            if stop is not None and index >= stop:
+                return
+            offset += len(line)
+            if index >= start:
+                yield index, offset, orjson.loads(line)
+            index += 1
+
+
+def load_checkpoint(path: Path) -> Optional[dict]:
+    try:
+        return orjson.loads(path.read_bytes())
+    except (FileNotFoundError, orjson.JSONDecodeError):
+        return None
+
+
+def save_checkpoint(path: Path, state: dict) -> None:
+    """Atomically replace the resume checkpoint."""
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(orjson.dumps(state))
+    os.replace(tmp, path)
+
+
+def open_id_index(path: Path, fresh: bool) -> sqlite3.Connection:
+    """On-disk index of classified OpenAlex ids, so --resume RAM stays flat."""
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")  # lookups don't block the writer thread
+    if fresh:
+        conn.execute("DROP TABLE IF EXISTS done")
+    conn.execute("CREATE TABLE IF NOT EXISTS done (id TEXT PRIMARY KEY)")
+    conn.commit()
+    return conn
+
+
+def rate_limit_delay(headers: Mapping[str, str]) -> float:
+    """Seconds to back off, from Retry-After or an exhausted X-RateLimit window."""
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    remaining = headers.get("x-ratelimit-remaining")
+    reset = headers.get("x-ratelimit-reset")
+    if remaining is None or not reset:
+        return 0.0
+    try:
+        if int(remaining) > 0:
+            return 0.0
+        reset_at = float(reset)
+    except ValueError:
+        return 0.0
+    # OpenRouter reports the reset as epoch milliseconds.
+    if reset_at > 1e11:
+        reset_at /= 1000.0
+    return max(0.0, reset_at - time.time())
+
+
+def build_items_prompt(batch_data: List[Dict[str, str]]) -> str:
+    """Fill ITEMS_TEMPLATE with one joined pass instead of join + str.format."""
+    parts = [PROMPT_HEAD]
+    append = parts.append
+    for i, b in enumerate(batch_data):
+        if i:
+            append("\n\n")
+        append(
+            f"- id: {b['id']}\n  title: {b['title']}\n  first_author: {b['first_author']}\n"
+            f"  year: {b['year']}\n  abstract: {b['abstract']}"
+        )
+    append(PROMPT_TAIL)
+    return "".join(parts)
+
+
+def user_content(items_prompt: str, model: str):
+    """User message with the static rubric first and the batch items last."""
+    if model.startswith(CACHE_CONTROL_PREFIXES):
+        return [
+            {"type": "text", "text": USER_RUBRIC, "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": items_prompt},
+        ]
+    return USER_RUBRIC + items_prompt
+
+
+# Marker spliced out of the pre-serialized request body (never JSON-escaped).
+ITEMS_PLACEHOLDER = "@@ITEMS@@"
+
+
+def build_payload(model: str, prompt: str) -> dict:
     payload = {
         "model": model,
         "messages": [
             {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": prompt},
+            {"role": "user", "content": user_content(prompt, model)},
         ],
         "response_format": {"type": "text"},
     }
@@ -104,33 +297,109 @@ def call_openrouter(api_key: str, prompt: str, model: str) -> str:
         # GLM-4.5-Air supports a boolean reasoning flag in its own API;
         # OpenRouter may or may not honor this on the free endpoint.
         payload["reasoning"] = {"enabled": True}
-    resp = requests.post(url, headers=headers, json=payload, timeout=120)
-    if resp.status_code == 429:
-        time.sleep(5)
-        resp = requests.post(url, headers=headers, json=payload, timeout=120)
+    return payload
+
+
+def payload_template(model: str) -> Tuple[bytes, bytes]:
+    """Serialize the request body once; only the batch items vary per call."""
+    head, tail = orjson.dumps(build_payload(model, ITEMS_PLACEHOLDER)).split(ITEMS_PLACEHOLDER.encode())
+    return head, tail
+
+
+def call_openrouter(
+    session: requests.Session,
+    prompt: str,
+    template: Tuple[bytes, bytes],
+    on_response: Optional[Callable[[requests.Response], None]] = None,
+) -> str:
+    head, tail = template
+    # orjson-encode just the prompt and drop its quotes to splice it into the string slot
+    body = b"".join((head, orjson.dumps(prompt)[1:-1], tail))
+    resp = session.post(OPENROUTER_URL, data=body, timeout=120)
+    if on_response:
+        on_response(resp)
     resp.raise_for_status()
     data = resp.json()
     return data["choices"][0]["message"]["content"]
 
 
+_JSON_TOKENS = re.compile(r'[\[\]"\\]')
+
+
+def iter_array_spans(text: str) -> Iterator[Tuple[int, int]]:
+    """Yield (start, end) of each top-level [...] span in one linear scan.
+
+    Brackets inside JSON strings (within an array) are ignored, honoring
+    backslash escapes; quotes in surrounding prose are not treated as strings.
+    """
+    depth = 0
+    start = 0
+    in_string = False
+    skip = -1
+    for match in _JSON_TOKENS.finditer(text):
+        i = match.start()
+        if i < skip:
+            continue  # escaped character
+        ch = text[i]
+        if in_string:
+            if ch == "\\":
+                skip = i + 2
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = depth > 0
+        elif ch == "[":
+            if not depth:
+                start = i
+            depth += 1
+        elif ch == "]" and depth:
+            depth -= 1
+            if not depth:
+                yield start, i + 1
+
+
+def abstract_key(abstract: str, model: str) -> Optional[str]:
+    """Verdict cache key: model plus whitespace/case-normalized abstract; None if empty."""
+    normalized = " ".join(abstract.lower().split())
+    if not normalized:
+        return None
+    return hashlib.blake2b(f"{model}\n{normalized}".encode(), digest_size=16).hexdigest()
+
+
+def match_verdicts(sent: List[Dict[str, str]], parsed: list) -> Dict[str, dict]:
+    """Map input ids to parsed verdicts by their `id` field, else by position."""
+    by_id = {v.get("id"): v for v in parsed if isinstance(v, dict)}
+    if not any(b["id"] in by_id for b in sent) and len(parsed) == len(sent):
+        by_id = {b["id"]: v for b, v in zip(sent, parsed) if isinstance(v, dict)}
+    return by_id
+
+
+def is_verdict_list(obj) -> bool:
+    """A non-empty JSON array of objects, the shape the rubric asks for."""
+    return isinstance(obj, list) and bool(obj) and all(isinstance(v, dict) for v in obj)
+
+
 def parse_model_json(text: str) -> Optional[list]:
-    """Extract JSON array from model output."""
+    """Extract the verdict array from model output.
+
+    Falls back to the longest bracketed span that decodes to a verdict list, so
+    citations like "[1]" or an empty "[ ]" in surrounding prose are ignored.
+    """
     text = text.strip()
     try:
-        obj = json.loads(text)
-        if isinstance(obj, list):
+        obj = orjson.loads(text)
+        if is_verdict_list(obj):
             return obj
-    except Exception:
+    except orjson.JSONDecodeError:
         pass
-    start = text.find("[")
-    end = text.rfind("]")
-    if start != -1 and end != -1 and end > start:
+    # Longest span first
+    for start, end in sorted(iter_array_spans(text), key=lambda span: span[0] - span[1]):
         try:
-            obj = json.loads(text[start : end + 1])
-            if isinstance(obj, list):
-                return obj
-        except Exception:
-            return None
+            obj = orjson.loads(text[start:end])
+        except orjson.JSONDecodeError:
+            continue
+        if is_verdict_list(obj):
+            return obj
     return None
 
 
@@ -140,12 +409,23 @@ def main():
     parser.add_argument("--output", type=Path, required=True, help="Output JSONL of classifications")
     parser.add_argument("--max", type=int, default=None, help="Limit number of records")
     parser.add_argument("--start", type=int, default=0, help="Skip first N records")
-    parser.add_argument("--batch-size", type=int, default=10, help="Number of papers per API call")
+    parser.add_argument("--batch-size", type=int, default=10, help="Initial number of papers per API call")
+    parser.add_argument("--max-batch-size", type=int, default=None, help="Upper bound for the adaptive batch size (default: --batch-size)")
+    parser.add_argument("--target-latency", type=float, default=60.0, help="Grow batches only while calls finish faster than this many seconds")
     parser.add_argument("--concurrency", type=int, default=10, help="Parallel API calls")
     parser.add_argument("--calls-per-minute", type=int, default=15, help="Throttle to this many calls/minute (safety below OpenRouter 20)")
-    parser.add_argument("--daily-call-cap", type=int, default=1000, help="Abort if planned calls exceed this cap")
-    parser.add_argument("--max-retries", type=int, default=3, help="Retries per batch on API/parse failure")
-    parser.add_argument("--resume", action="store_true", help="Append to existing output and skip already-processed batches")
+    parser.add_argument(
+        "--daily-call-cap",
+        type=int,
+        default=1000,
+        help=(
+            "Stop after this many OpenRouter requests, parse re-asks and 429 retries included; "
+            "urllib3's 5xx/connection retries are not counted. Truncates the run (rerun with --resume)"
+        ),
+    )
+    parser.add_argument("--max-retries", type=int, default=3, help="5xx retries per request, and attempts per batch on parse failure or 429")
+    parser.add_argument("--resume", action="store_true", help="Append to existing output and skip already-processed papers")
+    parser.add_argument("--compress", action="store_true", help="Write zstd-compressed output (adds .zst to --output)")
     parser.add_argument("--model", type=str, default=DEFAULT_MODEL, help="OpenRouter model slug (e.g. z-ai/glm-4.5-air:free or x-ai/grok-4.1-fast:free)")
     args = parser.parse_args()
 
@@ -154,134 +434,365 @@ def main():
         raise SystemExit("Set OPENROUTER_API_KEY")
 
     model = args.model
-
-    with args.input.open() as fp:
-        lines = fp.readlines()
-
-    if args.start:
-        lines = lines[args.start :]
-    if args.max:
-        lines = lines[: args.max]
-
-    # Load already processed ids if resuming
-    processed_ids = set()
-    processed_batches = 0
-    if args.resume and args.output.exists():
-        with args.output.open() as fp:
+    max_batch_size = max(args.max_batch_size or args.batch_size, args.batch_size)
+    if args.compress and args.output.suffix != ".zst":
+        args.output = args.output.with_name(args.output.name + ".zst")
+
+    # Index of already processed ids, kept next to the output (x.jsonl -> x.ids.sqlite)
+    resuming = args.resume and args.output.exists()
+    index_path = args.output.with_suffix(".ids.sqlite")
+    backfill = resuming and not index_path.exists()
+    done_ids = open_id_index(index_path, fresh=not resuming)
+    if backfill:
+        # Output predates the index: rebuild it once from the written records
+        with open_jsonl(args.output) as fp:
             for line in fp:
                 try:
-                    obj = json.loads(line)
-                    processed_batches += 1
-                    for pid in obj.get("input_ids", []):
-                        processed_ids.add(pid)
-                except Exception:
+                    obj = orjson.loads(line)
+                except orjson.JSONDecodeError:
                     continue
-
-    # Build batches
-    batches = []
-    for i in range(0, len(lines), args.batch_size):
-        batch_lines = lines[i : i + args.batch_size]
-        batch = []
-        for line in batch_lines:
-            obj = json.loads(line)
+                done_ids.executemany(
+                    "INSERT OR IGNORE INTO done (id) VALUES (?)",
+                    ((pid,) for pid in obj.get("input_ids", [])),
+                )
+        done_ids.commit()
+    # Separate connection for lookups from the main thread while the writer inserts
+    done_lookup = sqlite3.connect(index_path)
+
+    def is_done(pid: str) -> bool:
+        return done_lookup.execute("SELECT 1 FROM done WHERE id = ?", (pid,)).fetchone() is not None
+
+    # Verdicts keyed by abstract hash, so reprints and version duplicates skip the
+    # API call. Fresh runs start empty like the id index; shelve is not thread-safe.
+    verdict_cache = shelve.open(str(args.output.with_suffix(".cache")), flag="c" if resuming else "n")
+    cache_lock = threading.Lock()
+
+    # Input checkpoint: byte offset of the first record not yet covered by a
+    # contiguous run of finished batches, so resume seeks past finished input.
+    ckpt_path = args.output.with_suffix(".ckpt.json")
+    ckpt = load_checkpoint(ckpt_path) if resuming else None
+    if ckpt and (ckpt.get("input") != str(args.input) or ckpt.get("start") != args.start):
+        ckpt = None
+    if not resuming:
+        ckpt_path.unlink(missing_ok=True)
+    offset, first_index = (ckpt["next_byte_offset"], ckpt["next_record_index"]) if ckpt else (0, 0)
+
+    # Adaptive batch size: grow by one while calls are fast and unthrottled,
+    # halve on parse errors or rate-limit backpressure.
+    tune_lock = threading.Lock()
+    current_batch_size = args.batch_size
+    last_throttled = -math.inf
+
+    def tune_batch_size(grow: bool):
+        nonlocal current_batch_size, last_throttled
+        with tune_lock:
+            now = time.monotonic()
+            if not grow:
+                last_throttled = now
+                current_batch_size = max(1, current_batch_size // 2)
+            elif now - last_throttled > 60:
+                current_batch_size = min(max_batch_size, current_batch_size + 1)
+
+    def iter_batches():
+        """Stream (batch_start_index, batch, resume_point) sized at pull time.
+
+        Reads the input lazily, so a batch picks up the current tuned size when
+        a worker frees up. Papers already in the id index (finished past the
+        checkpoint, e.g. out-of-order completions) are skipped.
+        """
+        batch, chars, start_index, resume_point = [], 0, None, None
+        records = iter_records(args.input, args.start, args.max, offset=offset, index=first_index)
+        for index, end_offset, obj in records:
+            if resuming and is_done(obj.get("id")):
+                resume_point = (end_offset, index + 1)
+                continue
             abstract = reconstruct_abstract(obj.get("abstract_inverted_index"))
-            title = obj.get("title", "")
+            title = obj.get("title") or ""
+            size = len(title) + len(abstract)
+            if batch and (len(batch) >= current_batch_size or chars + size > MAX_BATCH_CHARS):
+                yield start_index, batch, resume_point
+                batch, chars = [], 0
+            if not batch:
+                start_index = index
             authors = obj.get("authorships") or []
             first_author = authors[0].get("author", {}).get("display_name", "") if authors else ""
             pub_year = obj.get("publication_year") or obj.get("year") or "N/A"
             batch.append(
                 {
                     "id": obj.get("id"),
-                    "title": title,
+                    "title": obj.get("title", ""),
                     "first_author": first_author,
                     "year": pub_year,
                     "abstract": abstract,
                 }
             )
-        batches.append((i + args.start, batch))
-
-    # Skip batches fully processed if resuming
-    if processed_ids:
-        batches = [
-            (idx, batch)
-            for idx, batch in batches
-            if not all(b["id"] in processed_ids for b in batch)
-        ]
-
-    planned_calls = len(batches)
-    if planned_calls > args.daily_call_cap:
-        raise SystemExit(f"Planned calls {planned_calls} exceed daily_call_cap={args.daily_call_cap}. Reduce --max or increase cap deliberately.")
-
-    # Rate limiter (token bucket with timestamps)
+            chars += size
+            resume_point = (end_offset, index + 1)
+        if batch:
+            yield start_index, batch, resume_point
+
+    # Daily call budget: every call_openrouter invocation (re-asks included) takes
+    # one slot; fully cached batches take none.
+    budget_lock = threading.Lock()
+    calls_made = 0
+
+    def take_call() -> bool:
+        nonlocal calls_made
+        with budget_lock:
+            if calls_made >= args.daily_call_cap:
+                return False
+            calls_made += 1
+            return True
+
+    # Rate limiter (sliding 60s window of call timestamps, plus server backpressure)
     limiter_lock = threading.Lock()
     call_timestamps = deque()
+    paused_until = 0.0
 
     def wait_for_slot():
         while True:
             with limiter_lock:
-                now = time.time()
+                now = time.monotonic()
                 # drop timestamps older than 60s
-                while call_timestamps and now - call_timestamps[0] > 60:
+                while call_timestamps and now - call_timestamps[0] >= 60:
                     call_timestamps.popleft()
-                if len(call_timestamps) < args.calls_per_minute:
-                    call_timestamps.append(now)
-                    return
-            time.sleep(0.2)
-
-    out_mode = "a" if args.resume else "w"
-    out_f = args.output.open(out_mode)
-    write_lock = threading.Lock()
+                delay = paused_until - now
+                if delay <= 0:
+                    if len(call_timestamps) < args.calls_per_minute:
+                        call_timestamps.append(now)
+                        return
+                    # sleep exactly until the oldest call leaves the window
+                    delay = 60 - (now - call_timestamps[0])
+            time.sleep(delay)
+
+    def note_rate_limit(resp: requests.Response):
+        nonlocal paused_until
+        throttled = resp.status_code == 429
+        delay = rate_limit_delay(resp.headers)
+        if throttled and delay <= 0:
+            delay = DEFAULT_RETRY_AFTER
+        if delay > 0:
+            with limiter_lock:
+                paused_until = max(paused_until, time.monotonic() + delay)
+        if delay > 0 or throttled:
+            tune_batch_size(grow=False)
+
+    session = make_session(api_key, args.concurrency, args.max_retries)
+    template = payload_template(model)
+    out_mode = "ab" if args.resume else "wb"
+    out_f = open_jsonl(args.output, out_mode)
+    if args.output.suffix == ".zst":
+        # end a zstd frame per write so everything checkpointed is decodable
+        def flush_output():
+            out_f.flush(zstd.FLUSH_FRAME)
+    else:
+        flush_output = out_f.flush
     total_inputs = 0
+    batch_ends = []  # resume point (byte offset, record index) after each scheduled batch
+    finished = set()
+    ckpt_next = 0  # position in `batch_ends` of the first unfinished batch
+
+    def advance_checkpoint(batch_no: int):
+        nonlocal ckpt_next
+        finished.add(batch_no)
+        if ckpt_next not in finished:
+            return
+        while ckpt_next in finished:
+            finished.remove(ckpt_next)
+            ckpt_next += 1
+        next_offset, next_index = batch_ends[ckpt_next - 1]
+        save_checkpoint(
+            ckpt_path,
+            {
+                "input": str(args.input),
+                "start": args.start,
+                "next_byte_offset": next_offset,
+                "next_record_index": next_index,
+            },
+        )
+
+    # Write-behind: workers enqueue finished lines and a single writer thread
+    # appends whatever has queued up in one write/flush/commit.
+    write_queue = queue.Queue()
 
-    def process_batch(batch_start_index: int, batch_data: List[Dict[str, str]]):
-        items_text = "\n\n".join(
-            [
-                f"- id: {b['id']}\n  title: {b['title']}\n  first_author: {b['first_author']}\n  year: {b['year']}\n  abstract: {b['abstract']}"
-                for b in batch_data
-            ]
+    def write_pending(pending: list):
+        out_f.write(b"".join(line for _, line, _ in pending))
+        flush_output()
+        done_ids.executemany(
+            "INSERT OR IGNORE INTO done (id) VALUES (?)",
+            ((pid,) for _, _, ids in pending for pid in ids),
         )
-        prompt = USER_TEMPLATE.format(items=items_text)
+        done_ids.commit()
+        for batch_no, _, _ in pending:
+            advance_checkpoint(batch_no)
+
+    # Set when a write fails; the main loop stops scheduling and main() re-raises it.
+    writer_error: Optional[BaseException] = None
+
+    def writer():
+        nonlocal writer_error
+        while True:
+            item = write_queue.get()
+            pending = []
+            while item is not None:
+                pending.append(item)
+                try:
+                    item = write_queue.get_nowait()
+                except queue.Empty:
+                    break
+            if pending:
+                try:
+                    write_pending(pending)
+                except BaseException as e:
+                    writer_error = e
+                    return
+            if item is None:
+                return
+
+    writer_thread = threading.Thread(target=writer, name="jsonl-writer", daemon=True)
+    writer_thread.start()
+
+    def process_batch(batch_no: int, batch_start_index: int, batch_data: List[Dict[str, str]]):
+        # Split off papers whose abstract already has a verdict, and send each
+        # distinct abstract in the batch only once.
+        keys = {b["id"]: abstract_key(b["abstract"], model) for b in batch_data}
+        known: Dict[str, dict] = {}
+        to_send = []
+        with cache_lock:
+            for b in batch_data:
+                key = keys[b["id"]]
+                if key is None:
+                    to_send.append(b)
+                elif key not in known:
+                    hit = verdict_cache.get(key)
+                    if hit is not None:
+                        known[key] = hit
+                    else:
+                        known[key] = None
+                        to_send.append(b)
+        cached_ids = [b["id"] for b in batch_data if known.get(keys[b["id"]]) is not None]
 
         response_text = None
         parsed = None
         error_msg = None
 
-        for attempt in range(1, args.max_retries + 1):
+        # HTTP-level retries live on the session adapter; this loop only re-asks
+        # the model when its reply could not be parsed.
+        prompt = build_items_prompt(to_send) if to_send else None
+        attempts = 0
+        for _ in range(args.max_retries if to_send else 0):
+            if not take_call():
+                break
+            attempts += 1
             wait_for_slot()
             try:
-                response_text = call_openrouter(api_key, prompt, model)
+                started = time.monotonic()
+                response_text = call_openrouter(session, prompt, template, on_response=note_rate_limit)
+                elapsed = time.monotonic() - started
                 parsed = parse_model_json(response_text)
                 if parsed is not None:
+                    if elapsed < args.target_latency:
+                        tune_batch_size(grow=True)
                     break  # success
                 else:
                     error_msg = "parse_error"
+                    tune_batch_size(grow=False)
+            except requests.HTTPError as e:
+                error_msg = f"exception: {e}"
+                if e.response is not None and e.response.status_code == 429:
+                    continue  # note_rate_limit paused the limiter; retry after it
+                break
             except Exception as e:
                 error_msg = f"exception: {e}"
-            # backoff a bit before retrying
-            time.sleep(1 + attempt)
+                break
+
+        if to_send and not attempts:
+            # Budget ran out before this batch was sent: leave it unrecorded so
+            # --resume picks it up (the checkpoint stays behind it).
+            return 0
 
         if parsed is None and error_msg:
             response_text = response_text or error_msg
 
+        if to_send and parsed is not None:
+            fresh = match_verdicts(to_send, parsed)
+            with cache_lock:
+                for b in to_send:
+                    key = keys[b["id"]]
+                    if key is not None and b["id"] in fresh:
+                        known[key] = verdict_cache[key] = fresh[b["id"]]
+        if len(to_send) < len(batch_data):
+            # Rebuild the verdict list in input order; duplicates get a copy of
+            # the shared verdict carrying their own id. Cached verdicts are kept
+            # even when the call for the rest of the batch failed, since their
+            # ids are marked done either way.
+            fresh = match_verdicts(to_send, parsed or [])
+            parsed = []
+            for b in batch_data:
+                verdict = fresh.get(b["id"]) or known.get(keys[b["id"]])
+                if verdict is not None:
+                    parsed.append({**verdict, "id": b["id"]})
+
         record = {
             "batch_start_index": batch_start_index,
             "input_ids": [b["id"] for b in batch_data],
             "model_raw": response_text,
             "model_parsed": parsed,
         }
-        with write_lock:
-            out_f.write(json.dumps(record))
-            out_f.write("\n")
-            out_f.flush()
+        if cached_ids:
+            record["cached_ids"] = cached_ids
+        line = orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE)
+        write_queue.put((batch_no, line, record["input_ids"]))
         return len(batch_data)
 
-    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
-        futures = [executor.submit(process_batch, idx, batch) for idx, batch in batches]
-        for fut in tqdm(as_completed(futures), total=len(futures), desc="Batches done", unit="batch"):
-            total_inputs += fut.result()
-
-    out_f.close()
-    print(f"Wrote {total_inputs} input papers across {len(batches)} batches to {args.output}")
+    # Submit lazily, keeping one batch in flight per worker, so each new batch is
+    # cut at the size tuned from the responses seen so far.
+    pending = set()
+    batches_written = 0
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor, tqdm(desc="Batches done", unit="batch") as pbar:
+
+            def drain():
+                # Block until at least one batch finishes, then account for every
+                # batch that is done, without re-scanning the set per completion.
+                nonlocal total_inputs, batches_written
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                pending.difference_update(done)
+                for fut in done:
+                    written = fut.result()
+                    total_inputs += written
+                    batches_written += written > 0
+                pbar.update(len(done))
+
+            batches = iter_batches()
+            while True:
+                # Wait for a free worker before cutting the next batch, so it is
+                # sized from the latest completed calls.
+                while len(pending) >= args.concurrency:
+                    drain()
+                if writer_error is not None or calls_made >= args.daily_call_cap:
+                    break
+                next_batch = next(batches, None)
+                if next_batch is None:
+                    break
+                idx, batch, end = next_batch
+                batch_ends.append(end)
+                pending.add(executor.submit(process_batch, len(batch_ends) - 1, idx, batch))
+            while pending:
+                drain()
+    finally:
+        write_queue.put(None)
+        writer_thread.join()
+        session.close()
+        out_f.close()
+        done_lookup.close()
+        done_ids.close()
+        verdict_cache.close()
+    if writer_error is not None:
+        raise RuntimeError(f"Writing {args.output} failed; fix the cause and rerun with --resume") from writer_error
+    if calls_made >= args.daily_call_cap:
+        print(f"Reached daily_call_cap={args.daily_call_cap} API calls; rerun with --resume to continue.")
+    print(f"Wrote {total_inputs} input papers across {batches_written} batches to {args.output}")
 
 
 if __name__ == "__main__":
@@ -3,24 +3,42 @@ Query OpenAlex for neural recording papers using an "Andrew White" API-first app
 
 - Uses OpenAlex search (no local dumps).
 - Broad recording keywords (ephys + optical), no neuron-term gate.
-- Saves JSONL metadata to data/openalex_single_neuron_<YYYY-MM-DD>.jsonl.
+- Saves JSONL metadata to data/openalex_single_neuron_<YYYY-MM-DD>.jsonl
+  (.jsonl.zst with --compress).
 """
 
 from __future__ import annotations
 
+import argparse
 import json
 import os
+import queue
+import threading
 import time
-from datetime import date
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from itertools import islice
 from pathlib import Path
-from typing import Iterable, Optional, Set
+from typing import Callable, Iterable, Iterator, List, Optional, Set, Tuple
 
+import ijson
 import requests
+import zstandard as zstd
 
 # OpenAlex identifiers
 BIO_RXIV_SOURCE_ID = "https://openalex.org/S4306402567"  # bioRxiv
 NEUROSCIENCE_CONCEPT_ID = "https://openalex.org/C169760540"  # Neuroscience concept (level 1)
 
+# Only the Work fields the classifier reads; the default representation is far larger.
+SELECT_FIELDS = "id,title,publication_year,abstract_inverted_index,authorships"
+
+# OpenAlex polite-pool limit is 10 requests/second; stay just under it.
+MAX_REQUESTS_PER_SECOND = 9
+
+# Works buffered per in-flight shard (one full page) before its worker blocks.
+SHARD_BUFFER = 200
+
 # Recording-related keywords (kept compact to stay under URL limits)
 RECORDING_TERMS = [
     # generic ephys
@@ -60,14 +78,55 @@ def build_search_query(terms: Iterable[str]) -> str:
     return " OR ".join(_quote(t) for t in terms)
 
 
+def month_windows(start_date: str, end_date: str) -> List[Tuple[str, str]]:
+    """Inclusive (from, to) publication-date windows per calendar month, newest first."""
+    start = date.fromisoformat(start_date)
+    end = date.fromisoformat(end_date)
+    windows = []
+    lo = start
+    while lo <= end:
+        next_month = (lo.replace(day=1) + timedelta(days=32)).replace(day=1)
+        hi = min(next_month - timedelta(days=1), end)
+        windows.append((lo.isoformat(), hi.isoformat()))
+        lo = next_month
+    windows.reverse()
+    return windows
+
+
+def iter_page(raw) -> Iterator[Tuple[str, object]]:
+    """
+    Incrementally parse one /works page from a byte stream.
+
+    Yields ("item", work) for each result as soon as it is complete, and
+    ("cursor", next_cursor) when the pagination cursor is reached, so the page
+    body is never materialized; how many yielded Works are buffered is up to
+    the caller.
+    """
+    builder = None
+    for prefix, event, value in ijson.parse(raw, use_float=True):
+        if prefix == "meta.next_cursor":
+            yield "cursor", value
+        elif prefix == "results.item" and event == "start_map":
+            builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+        elif builder is not None:
+            builder.event(event, value)
+            if prefix == "results.item" and event == "end_map":
+                yield "item", builder.value
+                builder = None
+
+
 def fetch_openalex(
     query: str,
     start_date: str = "2021-01-01",
+    end_date: Optional[str] = None,
     per_page: int = 200,
     max_results: Optional[int] = None,
     source_id: Optional[str] = None,
     concept_id: Optional[str] = None,
     sleep_on_rate_limit: int = 10,
+    session: Optional[requests.Session] = None,
+    throttle: Optional[Callable[[], None]] = None,
 ) -> Iterable[dict]:
     """
     Stream results from OpenAlex matching the query.
@@ -75,18 +134,25 @@ def fetch_openalex(
     Args:
         query: OpenAlex search string.
         start_date: inclusive publication date filter (YYYY-MM-DD).
+        end_date: optional inclusive upper publication date (YYYY-MM-DD).
         per_page: page size (max 200).
         max_results: optional cap to avoid runaway downloads.
         source_id: optional OpenAlex source id to restrict (e.g., bioRxiv).
         concept_id: optional OpenAlex concept id to restrict (e.g., Neuroscience).
         sleep_on_rate_limit: seconds to sleep when hitting 429.
+        session: optional keep-alive session reused across pages.
+        throttle: optional callable invoked before every request (shared rate limit).
     """
+    http = session or requests
     url = "https://api.openalex.org/works"
+    mailto = os.getenv("OPENALEX_MAILTO")  # joins OpenAlex's polite pool when set
     cursor = "*"
     fetched = 0
 
     while cursor:
         filters = [f"from_publication_date:{start_date}"]
+        if end_date:
+            filters.append(f"to_publication_date:{end_date}")
         if source_id:
             filters.append(f"primary_location.source.id:{source_id}")
         if concept_id:
@@ -98,44 +164,140 @@ def fetch_openalex(
             "per-page": per_page,
             "cursor": cursor,
             "sort": "publication_date:desc",
+            "select": SELECT_FIELDS,
         }
-        resp = requests.get(url, params=params, timeout=60)
-
-        if resp.status_code == 429:
-            time.sleep(sleep_on_rate_limit)
-            continue
-        resp.raise_for_status()
+        if mailto:
+            params["mailto"] = mailto
+        if throttle:
+            throttle()
+        with http.get(url, params=params, timeout=60, stream=True) as resp:
+            if resp.status_code == 429:
+                time.sleep(sleep_on_rate_limit)
+                continue
+            resp.raise_for_status()
 
-        payload = resp.json()
-        results = payload.get("results", [])
-        for item in results:
-            yield item
-            fetched += 1
-            if max_results and fetched >= max_results:
-                return
+            resp.raw.decode_content = True
+            cursor = None
+            for kind, value in iter_page(resp.raw):
+                if kind == "cursor":
+                    cursor = value
+                    continue
+                yield value
+                fetched += 1
+                if max_results and fetched >= max_results:
+                    return
 
-        cursor = payload.get("meta", {}).get("next_cursor")
         if not cursor:
             break
 
 
+def fetch_openalex_sharded(
+    query: str,
+    start_date: str = "2021-01-01",
+    end_date: Optional[str] = None,
+    workers: int = 4,
+    max_results: Optional[int] = None,
+    **kwargs,
+) -> Iterable[dict]:
+    """
+    Page monthly publication-date shards concurrently instead of one serial cursor.
+
+    Shards are yielded newest first, matching the single-cursor
+    `publication_date:desc` order. Up to `2 * workers` shards are in flight,
+    each streaming into a queue of at most SHARD_BUFFER Works; a worker blocks
+    once its queue is full, so at most `2 * workers * SHARD_BUFFER` Works are
+    held regardless of shard size. Each shard is capped at the `max_results`
+    budget still remaining when it starts, and all requests share one limiter
+    below the polite-pool rate. Remaining kwargs are forwarded to `fetch_openalex`.
+    """
+    windows = iter(month_windows(start_date, end_date or date.today().isoformat()))
+    lock = threading.Lock()
+    next_slot = 0.0
+    stop = threading.Event()
+    shard_done = object()
+
+    def throttle():
+        nonlocal next_slot
+        with lock:
+            now = time.monotonic()
+            wait = next_slot - now
+            next_slot = max(now, next_slot) + 1.0 / MAX_REQUESTS_PER_SECOND
+        if wait > 0:
+            time.sleep(wait)
+
+    def put(out: queue.Queue, item) -> bool:
+        # Block while the consumer is behind, but give up once it has stopped reading.
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def fetch_window(window: Tuple[str, str], budget: Optional[int], out: queue.Queue) -> None:
+        lo, hi = window
+        try:
+            for item in fetch_openalex(
+                query, start_date=lo, end_date=hi, max_results=budget, throttle=throttle, **kwargs
+            ):
+                if not put(out, item):
+                    return
+        finally:
+            put(out, shard_done)
+
+    fetched = 0
+
+    def submit(executor: ThreadPoolExecutor, window: Tuple[str, str]):
+        out: queue.Queue = queue.Queue(maxsize=SHARD_BUFFER)
+        budget = max_results - fetched if max_results else None
+        return executor.submit(fetch_window, window, budget, out), out
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque(submit(executor, w) for w in islice(windows, 2 * workers))
+        try:
+            while pending:
+                fut, out = pending.popleft()
+                while (item := out.get()) is not shard_done:
+                    yield item
+                    fetched += 1
+                    if max_results and fetched >= max_results:
+                        return
+                fut.result()  # re-raise a failed shard
+                window = next(windows, None)
+                if window:
+                    pending.append(submit(executor, window))
+        finally:
+            stop.set()
+            for fut, _ in pending:
+                fut.cancel()
+
+
 def save_jsonl(path: Path, items: Iterable[dict]) -> int:
-    """Write iterable of dicts to JSONL, return count."""
+    """Write iterable of dicts to JSONL (zstd-compressed for *.zst), return count."""
     count = 0
-    with path.open("w") as fp:
+    fp = path.open("wb")
+    if path.suffix == ".zst":
+        fp = zstd.ZstdCompressor(level=6, threads=-1).stream_writer(fp)
+    with fp:
         for obj in items:
-            fp.write(json.dumps(obj))
-            fp.write("\n")
+            fp.write(json.dumps(obj).encode())
+            fp.write(b"\n")
             count += 1
     return count
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--compress", action="store_true", help="Write zstd-compressed .jsonl.zst output")
+    args = parser.parse_args()
+
     data_dir = Path("data")
     data_dir.mkdir(parents=True, exist_ok=True)
 
     today = date.today().isoformat()
-    out_file = data_dir / f"openalex_biorxiv_neuro_{today}.jsonl"
+    suffix = ".jsonl.zst" if args.compress else ".jsonl"
+    out_file = data_dir / f"openalex_biorxiv_neuro_{today}{suffix}"
 
     search_query = build_search_query(RECORDING_TERMS)
     print(f"Querying OpenAlex with:\n  {search_query}")
@@ -145,12 +307,14 @@ def main():
     )
 
     seen: Set[str] = set()
+    session = requests.Session()
 
     def unique_items():
-        for item in fetch_openalex(
+        for item in fetch_openalex_sharded(
             search_query,
             source_id=BIO_RXIV_SOURCE_ID,
             concept_id=NEUROSCIENCE_CONCEPT_ID,
+            session=session,
         ):
             work_id = item.get("id")
             if work_id in seen:
@@ -158,7 +322,10 @@ def main():
             seen.add(work_id)
             yield item
 
-    count = save_jsonl(out_file, unique_items())
+    try:
+        count = save_jsonl(out_file, unique_items())
+    finally:
+        session.close()
     size_mb = out_file.stat().st_size / 1e6 if out_file.exists() else 0
     print(f"Saved {count} records to {out_file} ({size_mb:.1f} MB)")
 
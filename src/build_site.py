@@ -1,12 +1,15 @@
 from __future__ import annotations
 
-import json
+import argparse
+import hashlib
 import math
+import shutil
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Iterable
 
 import numpy as np
+import orjson
 import pandas as pd
 from fasthtml.common import (
     A,
@@ -29,12 +32,19 @@ from fasthtml.common import (
     Strong,
     Title,
     Ul,
+    to_xml,
 )
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 DATA_PATH = BASE_DIR / "neural_recording_papers.csv"
 PUBLIC_DIR = BASE_DIR / "public"
 ASSETS_DIR = PUBLIC_DIR / "assets"
+HTML_PATH = PUBLIC_DIR / "index.html"
+CSV_TARGET = PUBLIC_DIR / DATA_PATH.name
+# Kept outside public/, which is the deployed artifact.
+BUILD_KEY_PATH = BASE_DIR / ".build_key"
+# Stands in for the JSON payload inside the data <script> until the page is written.
+PAYLOAD_PLACEHOLDER = "@@NEURO_DATA@@"
 MONTH_NAMES = [
     "Jan",
     "Feb",
@@ -49,6 +59,7 @@ MONTH_NAMES = [
     "Nov",
     "Dec",
 ]
+MONTH_LABELS = np.array(MONTH_NAMES, dtype=object)
 DEFAULT_MONTH = 7
 FIT_RANGE_PADDING_YEARS = 5
 MAX_FUTURE_YEARS = 20
@@ -59,6 +70,38 @@ BIO_REFERENCES = [
     {"label": "Mouse brain (~7.1e7)", "neurons": 71_000_000},
 ]
 MAX_REFERENCE_NEURONS = max(ref["neurons"] for ref in BIO_REFERENCES)
+REFERENCE_LOG_NEURONS = np.log([ref["neurons"] for ref in BIO_REFERENCES])
+# Columns read from the CSV. Plain numpy/object dtypes keep blanks as NaN (not pd.NA).
+# Year, Month and Neurons are read as float because placeholder rows may leave them
+# blank; Year and Month are cast to int after rows without Neurons are dropped.
+# Method is categorical, with categories parsed in sorted order, so the method list
+# and per-method groups reuse them.
+CSV_DTYPES = {
+    "Year": "float64",
+    "Month": "float64",
+    "Neurons": "float64",
+    "Authors": "object",
+    "Method": "category",
+    "Source": "object",
+    "Publication": "object",
+    "Method Note": "object",
+    "DOI": "object",
+}
+# DataFrame column -> key in each plotted point, in payload order.
+POINT_FIELDS = {
+    "id": "id",
+    "Year": "year",
+    "Month": "month",
+    "date_label": "dateLabel",
+    "decimal_year": "decimalYear",
+    "Neurons": "neurons",
+    "Authors": "authors",
+    "method_label": "method",
+    "Source": "source",
+    "Publication": "publication",
+    "method_note": "methodNote",
+    "DOI": "doi",
+}
 
 
 @dataclass
@@ -70,9 +113,14 @@ class RegressionResult:
     series: list[dict[str, float]]
 
 
+def _decimal_year_fast(year, month):
+    # Validated inputs only (month already filled); works on scalars and arrays alike.
+    return year + (month - 0.5) / 12.0
+
+
 def _decimal_year(year: int, month: int | float | None) -> float:
     month = month if isinstance(month, (int, float)) and not math.isnan(month) else DEFAULT_MONTH
-    return float(year) + (float(month) - 0.5) / 12.0
+    return _decimal_year_fast(float(year), float(month))
 
 
 def _format_date(year: int, month: int | float | None) -> str:
@@ -85,27 +133,7 @@ def _short_label(label: str) -> str:
     return label.split("(")[0].strip()
 
 
-def _row_to_point(row: pd.Series) -> dict:
-    method_note = row.get("Method Note")
-    method_value = row.get("Method")
-    method_value = method_value if isinstance(method_value, str) and method_value.strip() else "Unknown"
-    return {
-        "id": int(row["id"]),
-        "year": int(row["Year"]),
-        "month": int(row["Month"]),
-        "dateLabel": _format_date(int(row["Year"]), int(row["Month"])),
-        "decimalYear": float(row["decimal_year"]),
-        "neurons": float(row["Neurons"]),
-        "authors": row["Authors"],
-        "method": method_value,
-        "source": row["Source"],
-        "publication": row["Publication"],
-        "methodNote": method_note if isinstance(method_note, str) else "",
-        "doi": row["DOI"],
-    }
-
-
-def _fit_regression(df: pd.DataFrame, label: str, x_range: tuple[float, float]) -> RegressionResult:
+def _fit(df: pd.DataFrame) -> tuple[float, float]:
     xs = df["decimal_year"].to_numpy()
     ys = df["Neurons"].to_numpy()
     mask = ys > 0
@@ -113,76 +141,108 @@ def _fit_regression(df: pd.DataFrame, label: str, x_range: tuple[float, float])
     ys = ys[mask]
     log_y = np.log(ys)
     slope, intercept = np.polyfit(xs, log_y, 1)
-    doubling = math.log(2) / slope if slope > 0 else None
+    return float(slope), float(intercept)
+
+
+def _build_series(slope: float, intercept: float, x_range: tuple[float, float]) -> list[dict[str, float]]:
     line_xs = np.linspace(x_range[0], x_range[1], 200)
-    series = [
-        {"decimalYear": float(x), "neurons": float(math.exp(intercept + slope * x))}
-        for x in line_xs
-    ]
-    return RegressionResult(label=label, slope=slope, intercept=intercept, doubling_time_years=doubling, series=series)
+    line_ys = np.exp(intercept + slope * line_xs)
+    return [{"decimalYear": x, "neurons": y} for x, y in zip(line_xs.tolist(), line_ys.tolist())]
 
 
-def _year_for_target(reg: RegressionResult, target: float) -> float | None:
-    if reg.slope <= 0 or target <= 0:
-        return None
-    return (math.log(target) - reg.intercept) / reg.slope
+def _regression(label: str, fit: tuple[float, float], x_range: tuple[float, float]) -> RegressionResult:
+    slope, intercept = fit
+    doubling = math.log(2) / slope if slope > 0 else None
+    series = _build_series(slope, intercept, x_range)
+    return RegressionResult(label=label, slope=slope, intercept=intercept, doubling_time_years=doubling, series=series)
 
 
-def _reference_hits(reg: RegressionResult) -> list[dict[str, float]]:
-    hits = []
-    for ref in BIO_REFERENCES:
-        estimate = _year_for_target(reg, ref["neurons"])
-        if estimate is None:
-            continue
-        hits.append({"label": ref["label"], "year": estimate})
-    return hits
+def _reference_hits(fits: list[tuple[float, float]]) -> list[list[dict[str, float]]]:
+    slopes, intercepts = np.array(fits, dtype=np.float64).reshape(-1, 2).T
+    with np.errstate(divide="ignore", invalid="ignore"):
+        years = (REFERENCE_LOG_NEURONS[None, :] - intercepts[:, None]) / slopes[:, None]
+    years[slopes <= 0] = np.nan
+    return [
+        [{"label": ref["label"], "year": year} for ref, year in zip(BIO_REFERENCES, row) if not math.isnan(year)]
+        for row in years.tolist()
+    ]
+
 
+def _write_html(document: Iterable, path: Path, payload: bytes) -> None:
+    # Encode and write each top-level node (doctype, html) straight to a binary buffer
+    # instead of building the page as one str and re-encoding it in write_text. The
+    # serialized payload is written in place of PAYLOAD_PLACEHOLDER, so it never
+    # round-trips through str.
+    with path.open("wb", buffering=1 << 20) as fp:
+        for node in document:
+            head, sep, tail = to_xml(node, indent=False).encode("utf-8").partition(PAYLOAD_PLACEHOLDER.encode())
+            fp.write(head)
+            if sep:
+                fp.write(payload)
+                fp.write(tail)
+
+
+def _build_key() -> str:
+    # CSV identity plus a hash of this script, so editing either forces a rebuild.
+    stat = DATA_PATH.stat()
+    script_hash = hashlib.blake2b(Path(__file__).read_bytes(), digest_size=8).hexdigest()
+    return f"{stat.st_mtime_ns}:{stat.st_size}:{script_hash}"
+
+
+def _site_up_to_date() -> bool:
+    return (
+        HTML_PATH.exists()
+        and CSV_TARGET.exists()
+        and BUILD_KEY_PATH.exists()
+        and BUILD_KEY_PATH.read_text(encoding="utf-8") == _build_key()
+    )
 
-def _render(document: Iterable) -> str:
-    return "".join(str(node) for node in document)
 
+def build_site(force: bool = False) -> Path:
+    html_path = HTML_PATH
+    csv_target = CSV_TARGET
+    if not force and _site_up_to_date():
+        return html_path
+    # Taken before reading the CSV, so an edit made mid-build is not stamped as built.
+    build_key = _build_key()
 
-def build_site() -> Path:
-    df = pd.read_csv(DATA_PATH)
+    df = pd.read_csv(DATA_PATH, usecols=list(CSV_DTYPES), dtype=CSV_DTYPES)
     df = df[df["Neurons"].notna()].copy()
+    df["Year"] = df["Year"].astype(int)
     df["Month"] = df["Month"].fillna(DEFAULT_MONTH).astype(int)
-    df["decimal_year"] = df.apply(lambda r: _decimal_year(int(r["Year"]), r["Month"]), axis=1)
+    df["Method"] = df["Method"].cat.remove_unused_categories()
+    year_arr = df["Year"].to_numpy(dtype=np.float64)
+    month_arr = df["Month"].to_numpy(dtype=np.float64)
+    df["decimal_year"] = _decimal_year_fast(year_arr, month_arr)
     df["id"] = range(len(df))
 
-    points = [_row_to_point(row) for _, row in df.iterrows()]
+    month_labels = MONTH_LABELS[df["Month"].clip(1, 12).to_numpy() - 1]
+    df["date_label"] = [f"{label} {year}" for label, year in zip(month_labels, df["Year"].tolist())]
+    method_categories = df["Method"].cat.categories.tolist()
+    # Blank categories and missing values (code -1, the appended last entry) read "Unknown".
+    method_labels = np.array([m if m.strip() else "Unknown" for m in method_categories] + ["Unknown"], dtype=object)
+    df["method_label"] = method_labels[df["Method"].cat.codes.to_numpy()]
+    df["method_note"] = df["Method Note"].fillna("")
+
+    keys = tuple(POINT_FIELDS.values())
+    points = [dict(zip(keys, row)) for row in df[list(POINT_FIELDS)].itertuples(index=False, name=None)]
 
     min_year = float(df["decimal_year"].min())
     max_year = float(df["decimal_year"].max())
-    frontier = (
-        df.sort_values(["Year", "Neurons"], ascending=[True, True])
-        .groupby("Year", as_index=False)
-        .tail(1)
-    )
-    methods = sorted(df["Method"].fillna("Unknown").unique().tolist())
-
-    def compute_regressions(range_end: float):
-        current_range = (min_year, range_end)
-        reg_all = _fit_regression(df, "All datapoints", current_range)
-        reg_frontier = _fit_regression(frontier, "Best in year", current_range)
-        method_results = []
-        for method_name in methods:
-            subset = df[df["Method"] == method_name]
-            if subset.empty:
-                continue
-            reg_method = _fit_regression(subset, method_name, current_range)
-            method_results.append(
-                {
-                    "method": method_name,
-                    "count": int(len(subset)),
-                    "reg": reg_method,
-                    "referenceHits": _reference_hits(reg_method),
-                }
-            )
-        return current_range, reg_all, reg_frontier, method_results
-
-    initial_end = max_year + FIT_RANGE_PADDING_YEARS
-    fit_range, reg_all, reg_frontier, method_results = compute_regressions(initial_end)
-    frontier_hits = _reference_hits(reg_frontier)
+    # Per-year max without a full sort; scanning in reverse keeps the last row on ties,
+    # as the previous sort + tail(1) did.
+    frontier = df.loc[df.iloc[::-1].groupby("Year")["Neurons"].idxmax().to_numpy()]
+    methods = sorted({*method_categories, "Unknown"}) if df["Method"].hasnans else method_categories
+
+    # Rows with no Method fall out of the groupby, so "Unknown" stays without a fit.
+    method_groups = dict(list(df.groupby("Method", sort=False, observed=True)))
+    # Fits and milestone years depend only on the points, so the plotted range is
+    # settled first and every line is sampled once over it.
+    fit_all = _fit(df)
+    fit_frontier = _fit(frontier)
+    method_fits = {name: _fit(method_groups[name]) for name in methods if name in method_groups}
+    frontier_hits, *hits_per_method = _reference_hits([fit_frontier, *method_fits.values()])
+    method_hits = dict(zip(method_fits, hits_per_method))
 
     cap_year = min(max_year + MAX_FUTURE_YEARS, X_RANGE_MAX)
 
@@ -192,34 +252,31 @@ def build_site() -> Path:
 
     base_need = max_year + FIT_RANGE_PADDING_YEARS
     candidates = [base_need, _max_hit_within(frontier_hits)]
-    for entry in method_results:
-        candidates.append(_max_hit_within(entry["referenceHits"]))
-    desired_end = min(cap_year, max(candidates))
-    if abs(desired_end - fit_range[1]) > 1e-6:
-        fit_range, reg_all, reg_frontier, method_results = compute_regressions(desired_end)
-        frontier_hits = _reference_hits(reg_frontier)
-
-    method_stats = [
-        {
-            "method": entry["method"],
-            "count": entry["count"],
-            "doublingTimeYears": entry["reg"].doubling_time_years,
-            "series": entry["reg"].series,
-            "referenceHits": entry["referenceHits"],
-        }
-        for entry in method_results
+    for hits in method_hits.values():
+        candidates.append(_max_hit_within(hits))
+    fit_range = (min_year, min(cap_year, max(candidates)))
+
+    reg_all = _regression("All datapoints", fit_all, fit_range)
+    reg_frontier = _regression("Best in year", fit_frontier, fit_range)
+    method_stats = []
+    for method_name, fit in method_fits.items():
+        reg_method = _regression(method_name, fit, fit_range)
+        method_stats.append(
+            {
+                "method": method_name,
+                "count": int(len(method_groups[method_name])),
+                "doublingTimeYears": reg_method.doubling_time_years,
+                "series": reg_method.series,
+                "referenceHits": method_hits[method_name],
+            }
+        )
+
+    top_row = df.iloc[int(df["Neurons"].to_numpy().argmax())]
+    latest_row = df.iloc[int(df["decimal_year"].to_numpy().argmax())]
+    source_counts = [
+        {"Source": source, "count": int(count)} for source, count in df["Source"].value_counts().items()
     ]
 
-    top_row = df.loc[df["Neurons"].idxmax()]
-    latest_row = df.loc[df["decimal_year"].idxmax()]
-    source_counts = (
-        df.groupby("Source")
-        .size()
-        .sort_values(ascending=False)
-        .reset_index(name="count")
-        .to_dict("records")
-    )
-
     payload = {
         "points": points,
         "regressions": {
@@ -361,7 +418,7 @@ def build_site() -> Path:
                 )
             ),
             Script(
-                json.dumps(payload, separators=(",", ":")),
+                PAYLOAD_PLACEHOLDER,
                 id="neuro-data",
                 type="application/json",
             ),
@@ -371,10 +428,9 @@ def build_site() -> Path:
 
     PUBLIC_DIR.mkdir(parents=True, exist_ok=True)
     ASSETS_DIR.mkdir(parents=True, exist_ok=True)
-    html_path = PUBLIC_DIR / "index.html"
-    html_path.write_text(_render(doc), encoding="utf-8")
-    csv_target = PUBLIC_DIR / DATA_PATH.name
-    csv_target.write_bytes(DATA_PATH.read_bytes())
+    _write_html(doc, html_path, orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY))
+    shutil.copyfile(DATA_PATH, csv_target)
+    BUILD_KEY_PATH.write_text(build_key, encoding="utf-8")
     return html_path
 
 
@@ -392,6 +448,16 @@ def _format_year(value: float | None) -> str:
     return f"{value:.0f}"
 
 
-if __name__ == "__main__":
-    output = build_site()
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate public/index.html from the curated CSV.")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the CSV and this script are unchanged")
+    args = parser.parse_args()
+    if not args.force and _site_up_to_date():
+        print(f"{HTML_PATH} is up to date")
+        return
+    output = build_site(force=True)
     print(f"Wrote {output}")
+
+
+if __name__ == "__main__":
+    main()